@@ -12,6 +12,8 @@ import torch
 import torch.nn as nn
 from _pytest.fixtures import SubRequest
 from _pytest.monkeypatch import MonkeyPatch
+from rasterio.windows import Window
+from torch.utils.data import SequentialSampler
 
 from torchgeo.datasets import Potsdam2D, Potsdam2DDataModule
 
@@ -21,10 +23,10 @@ class TestPotsdam2D:
     def dataset(
         self, monkeypatch: Generator[MonkeyPatch, None, None], request: SubRequest
     ) -> Potsdam2D:
-        md5s = ["e47175da529c5844052c7d483b483a30", "0cb795003a01154a72db7efaabbc76ae"]
+        md5s = ("e47175da529c5844052c7d483b483a30", "0cb795003a01154a72db7efaabbc76ae")
         splits = {
-            "train": ["top_potsdam_2_10", "top_potsdam_2_11"],
-            "test": ["top_potsdam_5_15", "top_potsdam_6_15"],
+            "train": ("top_potsdam_2_10", "top_potsdam_2_11"),
+            "test": ("top_potsdam_5_15", "top_potsdam_6_15"),
         }
         monkeypatch.setattr(Potsdam2D, "md5s", md5s)  # type: ignore[attr-defined]
         monkeypatch.setattr(Potsdam2D, "splits", splits)  # type: ignore[attr-defined]
@@ -38,10 +40,42 @@ class TestPotsdam2D:
         assert isinstance(x, dict)
         assert isinstance(x["image"], torch.Tensor)
         assert isinstance(x["mask"], torch.Tensor)
+        assert x["mask"].dtype == torch.uint8  # type: ignore[attr-defined]
 
     def test_len(self, dataset: Potsdam2D) -> None:
         assert len(dataset) == 2
 
+    def test_cache(self, dataset: Potsdam2D, tmp_path: Path) -> None:
+        root = os.path.join(str(tmp_path), "potsdam")
+        shutil.copytree(dataset.root, root)
+        ds = Potsdam2D(root, dataset.split, cache=True)
+        x = ds[0]
+        for path in ds.files[0].values():
+            assert os.path.exists(os.path.splitext(path)[0] + ".npy")
+        y = ds[0]
+        assert torch.equal(x["image"], y["image"])  # type: ignore[attr-defined]
+        assert torch.equal(x["mask"], y["mask"])  # type: ignore[attr-defined]
+        x = ds[0, Window(0.2, 0.2, 1, 1)]
+        assert x["image"].shape == (4, 1, 1)
+        assert x["mask"].shape == (1, 1)
+        with pytest.raises(ValueError, match="extends past"):
+            ds[0, Window(1, 1, 2, 2)]
+
+    def test_bands(self, dataset: Potsdam2D, tmp_path: Path) -> None:
+        ds = Potsdam2D(dataset.root, dataset.split, bands=(1, 2, 3))
+        assert ds[0]["image"].shape[0] == 3
+        root = os.path.join(str(tmp_path), "potsdam")
+        shutil.copytree(dataset.root, root)
+        ds = Potsdam2D(root, dataset.split, cache=True, bands=(4,))
+        assert ds[0]["image"].shape[0] == 1
+
+    def test_window(self, dataset: Potsdam2D) -> None:
+        x = dataset[0, Window(0.2, 0.2, 1, 1)]
+        assert x["image"].shape == (4, 1, 1)
+        assert x["mask"].shape == (1, 1)
+        with pytest.raises(ValueError, match="extends past"):
+            dataset[0, Window(1, 1, 2, 2)]
+
     def test_extract(self, tmp_path: Path) -> None:
         root = os.path.join("tests", "data", "potsdam")
         for filename in ["4_Ortho_RGBIR.zip", "5_Labels_all.zip"]:
@@ -75,6 +109,9 @@ class TestPotsdam2D:
         x["prediction"] = x["mask"].clone()
         dataset.plot(x)
         plt.close()
+        x["image"] = x["image"].float() / 255.0
+        dataset.plot(x)
+        plt.close()
 
 
 class TestPotsdam2DDataModule:
@@ -95,7 +132,27 @@ class TestPotsdam2DDataModule:
         next(iter(datamodule.train_dataloader()))
 
     def test_val_dataloader(self, datamodule: Potsdam2DDataModule) -> None:
-        next(iter(datamodule.val_dataloader()))
+        dataloader = datamodule.val_dataloader()
+        assert isinstance(dataloader.sampler, SequentialSampler)
+        next(iter(dataloader))
 
     def test_test_dataloader(self, datamodule: Potsdam2DDataModule) -> None:
         next(iter(datamodule.test_dataloader()))
+
+    def test_worker_kwargs(self) -> None:
+        root = os.path.join("tests", "data", "potsdam")
+        dm = Potsdam2DDataModule(root, batch_size=1, num_workers=1)
+        dm.setup()
+        dataloader = dm.test_dataloader()
+        assert dataloader.persistent_workers
+        assert dataloader.prefetch_factor == 4
+        next(iter(dataloader))
+        dm.num_workers = 0
+        next(iter(dm.test_dataloader()))
+
+    def test_on_after_batch_transfer(self, datamodule: Potsdam2DDataModule) -> None:
+        batch = next(iter(datamodule.train_dataloader()))
+        batch = datamodule.on_after_batch_transfer(batch, 0)
+        assert batch["image"].dtype == torch.float32  # type: ignore[attr-defined]
+        assert batch["image"].max() <= 1.0
+        assert batch["mask"].dtype == torch.long  # type: ignore[attr-defined]
@@ -23,6 +23,8 @@ from torch.utils.data import TensorDataset
 import torchgeo.datasets.utils
 from torchgeo.datasets.utils import (
     BoundingBox,
+    _get_io_pool,
+    _save_npy,
     concat_samples,
     dataset_split,
     disambiguate_timestamp,
@@ -32,6 +34,7 @@ from torchgeo.datasets.utils import (
     extract_archive,
     merge_samples,
     percentile_normalization,
+    rgb_to_mask,
     stack_samples,
     working_dir,
 )
@@ -85,6 +88,33 @@ def test_mock_missing_module(mock_missing_module: None) -> None:
     import sys  # noqa: F401
 
 
+def test_get_io_pool() -> None:
+    pool = _get_io_pool()
+    assert _get_io_pool() is pool
+    assert pool.submit(sum, [1, 2]).result() == 3
+
+
+def test_save_npy(tmp_path: Path) -> None:
+    path = os.path.join(tmp_path, "array.npy")
+    array = np.arange(6, dtype=np.uint8).reshape(2, 3)
+    _save_npy(path, array)
+    _save_npy(path, array)
+    assert os.listdir(tmp_path) == ["array.npy"]
+    assert np.array_equal(np.load(path, mmap_mode="c"), array)
+
+
+def test_save_npy_interrupted(
+    monkeypatch: Generator[MonkeyPatch, None, None], tmp_path: Path
+) -> None:
+    def save(*args: Any, **kwargs: Any) -> None:
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(np, "save", save)  # type: ignore[attr-defined]
+    with pytest.raises(KeyboardInterrupt):
+        _save_npy(os.path.join(tmp_path, "array.npy"), np.zeros(1))
+    assert os.listdir(tmp_path) == []
+
+
 # TODO: figure out how to install unrar on Windows in GitHub Actions
 @pytest.mark.skipif(sys.platform == "win32", reason="requires unrar executable")
 @pytest.mark.parametrize(
@@ -587,3 +617,18 @@ def test_percentile_normalization() -> None:
     img = percentile_normalization(img, 2, 98)
     assert img.min() == 0
     assert img.max() == 1
+
+
+def test_rgb_to_mask() -> None:
+    colors = [(255, 0, 0), (255, 255, 255), (0, 0, 255)]
+    rgb = np.array(
+        [[[0, 0, 255], [255, 255, 255]], [[255, 0, 0], [1, 2, 3]]], dtype=np.uint8
+    )
+    mask = rgb_to_mask(rgb, colors)
+    assert mask.dtype == np.uint8
+    assert mask.tolist() == [[2, 1], [0, 0]]
+    mask = rgb_to_mask(rgb.astype(np.float32), colors)
+    assert mask.tolist() == [[2, 1], [0, 0]]
+    # 511 and 255.5 would wrap or truncate to a valid color when cast to uint8
+    rgb = np.array([[[0, 0, 511], [255, 255, 255.5]]])
+    assert rgb_to_mask(rgb, colors).tolist() == [[0, 0]]
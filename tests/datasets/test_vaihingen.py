@@ -12,6 +12,7 @@ import torch
 import torch.nn as nn
 from _pytest.fixtures import SubRequest
 from _pytest.monkeypatch import MonkeyPatch
+from torch.utils.data import SequentialSampler
 
 from torchgeo.datasets import Vaihingen2D, Vaihingen2DDataModule
 
@@ -21,10 +22,10 @@ class TestVaihingen2D:
     def dataset(
         self, monkeypatch: Generator[MonkeyPatch, None, None], request: SubRequest
     ) -> Vaihingen2D:
-        md5s = ["c15fbff78d307e51c73f609c0859afc3", "ec2c0a5149f2371479b38cf8cfbab961"]
+        md5s = ("c15fbff78d307e51c73f609c0859afc3", "ec2c0a5149f2371479b38cf8cfbab961")
         splits = {
-            "train": ["top_mosaic_09cm_area1.tif", "top_mosaic_09cm_area11.tif"],
-            "test": ["top_mosaic_09cm_area6.tif", "top_mosaic_09cm_area24.tif"],
+            "train": ("top_mosaic_09cm_area1.tif", "top_mosaic_09cm_area11.tif"),
+            "test": ("top_mosaic_09cm_area6.tif", "top_mosaic_09cm_area24.tif"),
         }
         monkeypatch.setattr(Vaihingen2D, "md5s", md5s)  # type: ignore[attr-defined]
         monkeypatch.setattr(Vaihingen2D, "splits", splits)  # type: ignore[attr-defined]
@@ -38,12 +39,24 @@ class TestVaihingen2D:
         assert isinstance(x, dict)
         assert isinstance(x["image"], torch.Tensor)
         assert isinstance(x["mask"], torch.Tensor)
+        assert x["mask"].dtype == torch.uint8  # type: ignore[attr-defined]
         assert x["image"].ndim == 3
         assert x["mask"].ndim == 2
 
     def test_len(self, dataset: Vaihingen2D) -> None:
         assert len(dataset) == 2
 
+    def test_cache(self, dataset: Vaihingen2D, tmp_path: Path) -> None:
+        root = os.path.join(str(tmp_path), "vaihingen")
+        shutil.copytree(dataset.root, root)
+        ds = Vaihingen2D(root, dataset.split, cache=True)
+        x = ds[0]
+        for path in ds.files[0].values():
+            assert os.path.exists(os.path.splitext(path)[0] + ".npy")
+        y = ds[0]
+        assert torch.equal(x["image"], y["image"])  # type: ignore[attr-defined]
+        assert torch.equal(x["mask"], y["mask"])  # type: ignore[attr-defined]
+
     def test_extract(self, tmp_path: Path) -> None:
         root = os.path.join("tests", "data", "vaihingen")
         filenames = [
@@ -84,6 +97,9 @@ class TestVaihingen2D:
         x["prediction"] = x["mask"].clone()
         dataset.plot(x)
         plt.close()
+        x["image"] = x["image"].float() / 255.0
+        dataset.plot(x)
+        plt.close()
 
 
 class TestVaihingen2DDataModule:
@@ -104,7 +120,27 @@ class TestVaihingen2DDataModule:
         next(iter(datamodule.train_dataloader()))
 
     def test_val_dataloader(self, datamodule: Vaihingen2DDataModule) -> None:
-        next(iter(datamodule.val_dataloader()))
+        dataloader = datamodule.val_dataloader()
+        assert isinstance(dataloader.sampler, SequentialSampler)
+        next(iter(dataloader))
 
     def test_test_dataloader(self, datamodule: Vaihingen2DDataModule) -> None:
         next(iter(datamodule.test_dataloader()))
+
+    def test_worker_kwargs(self) -> None:
+        root = os.path.join("tests", "data", "vaihingen")
+        dm = Vaihingen2DDataModule(root, batch_size=1, num_workers=1)
+        dm.setup()
+        dataloader = dm.test_dataloader()
+        assert dataloader.persistent_workers
+        assert dataloader.prefetch_factor == 4
+        next(iter(dataloader))
+        dm.num_workers = 0
+        next(iter(dm.test_dataloader()))
+
+    def test_on_after_batch_transfer(self, datamodule: Vaihingen2DDataModule) -> None:
+        batch = next(iter(datamodule.train_dataloader()))
+        batch = datamodule.on_after_batch_transfer(batch, 0)
+        assert batch["image"].dtype == torch.float32  # type: ignore[attr-defined]
+        assert batch["image"].max() <= 1.0
+        assert batch["mask"].dtype == torch.long  # type: ignore[attr-defined]
@@ -12,6 +12,7 @@ import torch
 import torch.nn as nn
 from _pytest.fixtures import SubRequest
 from _pytest.monkeypatch import MonkeyPatch
+from torch.utils.data import SequentialSampler
 
 from torchgeo.datasets import XView2, XView2DataModule
 
@@ -47,10 +48,37 @@ class TestXView2:
         assert isinstance(x, dict)
         assert isinstance(x["image"], torch.Tensor)
         assert isinstance(x["mask"], torch.Tensor)
+        assert x["image"].is_contiguous()
+        assert dataset.size == (128, 128)
+        assert x["image"].shape == (2, 3, 128, 128)
+        assert x["mask"].shape == (2, 128, 128)
+        assert x["mask"].dtype == torch.uint8  # type: ignore[attr-defined]
 
     def test_len(self, dataset: XView2) -> None:
         assert len(dataset) == 2
 
+    def test_files_sorted(self, dataset: XView2) -> None:
+        images = [files["image1"] for files in dataset.files]
+        assert images == sorted(images)
+
+    def test_cache(self, tmp_path: Path) -> None:
+        root = os.path.join(tmp_path, "xview2")
+        shutil.copytree(os.path.join("tests", "data", "xview2"), root)
+        dataset = XView2(root, cache=True)
+        expected = XView2(os.path.join("tests", "data", "xview2"))[0]
+        for _ in range(2):
+            x = dataset[0]
+            assert torch.equal(  # type: ignore[attr-defined]
+                x["image"], expected["image"]
+            )
+            assert torch.equal(  # type: ignore[attr-defined]
+                x["mask"], expected["mask"]
+            )
+        for directory in ["images", "targets"]:
+            filenames = os.listdir(os.path.join(root, "train", directory))
+            assert sum(f.endswith(".npy") for f in filenames) == 2
+        assert len(dataset) == 2
+
     def test_extract(self, tmp_path: Path) -> None:
         shutil.copyfile(
             os.path.join(
@@ -66,6 +94,16 @@ class TestXView2:
         )
         XView2(root=str(tmp_path))
 
+    def test_extract_single_split(self, tmp_path: Path) -> None:
+        shutil.copyfile(
+            os.path.join(
+                "tests", "data", "xview2", "test_images_labels_targets.tar.gz"
+            ),
+            os.path.join(tmp_path, "test_images_labels_targets.tar.gz"),
+        )
+        XView2(root=str(tmp_path), split="test")
+        assert not os.path.exists(os.path.join(tmp_path, "train"))
+
     def test_corrupted(self, tmp_path: Path) -> None:
         with open(
             os.path.join(tmp_path, "train_images_labels_targets.tar.gz"), "w"
@@ -115,7 +153,40 @@ class TestXView2DataModule:
         next(iter(datamodule.train_dataloader()))
 
     def test_val_dataloader(self, datamodule: XView2DataModule) -> None:
-        next(iter(datamodule.val_dataloader()))
+        dataloader = datamodule.val_dataloader()
+        assert isinstance(dataloader.sampler, SequentialSampler)
+        next(iter(dataloader))
 
     def test_test_dataloader(self, datamodule: XView2DataModule) -> None:
         next(iter(datamodule.test_dataloader()))
+
+    def test_worker_kwargs(self) -> None:
+        root = os.path.join("tests", "data", "xview2")
+        dm = XView2DataModule(root, batch_size=1, num_workers=1)
+        dm.setup()
+        dataloader = dm.test_dataloader()
+        assert dataloader.persistent_workers
+        assert dataloader.prefetch_factor == 4
+        next(iter(dataloader))
+        dm.num_workers = 0
+        next(iter(dm.test_dataloader()))
+
+    def test_on_after_batch_transfer(self, datamodule: XView2DataModule) -> None:
+        batch = next(iter(datamodule.train_dataloader()))
+        batch = datamodule.on_after_batch_transfer(batch, 0)
+        assert batch["image"].dtype == torch.float32  # type: ignore[attr-defined]
+        assert batch["image"].max() <= 1.0
+        assert batch["mask"].dtype == torch.long  # type: ignore[attr-defined]
+
+    def test_pack_masks(self) -> None:
+        root = os.path.join("tests", "data", "xview2")
+        dm = XView2DataModule(root, 1, 0, pack_masks=True)
+        dm.setup()
+        batch = next(iter(dm.test_dataloader()))
+        assert batch["mask"].shape == (1, 2, 128, 64)
+        batch = dm.on_after_batch_transfer(batch, 0)
+        expected = XView2(root, "test")[0]["mask"].long()
+        assert torch.equal(batch["mask"][0], expected)  # type: ignore[attr-defined]
+        mask = torch.zeros(2, 4, 3, dtype=torch.uint8)  # type: ignore[attr-defined]
+        with pytest.raises(AssertionError, match="odd width"):
+            dm.pack({"mask": mask})
@@ -4,7 +4,7 @@
 """Potsdam dataset."""
 
 import os
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -12,14 +12,47 @@ import pytorch_lightning as pl
 import rasterio
 import torch
 from matplotlib.figure import Figure
-from PIL import Image
+from rasterio.windows import Window
 from torch import Tensor
 from torch.utils.data import DataLoader
-from torchvision.transforms import Compose
 
 from ..datasets.utils import dataset_split, draw_semantic_segmentation_masks
 from .geo import VisionDataset
-from .utils import check_integrity, extract_archive, rgb_to_mask
+from .utils import (
+    _get_io_pool,
+    _save_npy,
+    check_integrity,
+    extract_archive,
+    rgb_to_mask,
+)
+
+
+def _check_window(window: Window, height: int, width: int) -> Window:
+    """Round a pixel window to whole pixels and check that it lies within a raster.
+
+    Windows computed from bounds, e.g. with :func:`rasterio.windows.from_bounds`,
+    have fractional offsets and lengths, which cannot be used to slice arrays.
+
+    Args:
+        window: pixel window to read
+        height: height of the raster
+        width: width of the raster
+
+    Returns:
+        the window with integer offsets and lengths
+
+    Raises:
+        ValueError: if the window extends past the raster
+    """
+    window = window.round_offsets().round_lengths()
+    if (
+        window.col_off < 0
+        or window.row_off < 0
+        or window.col_off + window.width > width
+        or window.row_off + window.height > height
+    ):
+        raise ValueError(f"{window} extends past the {height}x{width} raster")
+    return window
 
 
 class Potsdam2D(VisionDataset):
@@ -53,11 +86,11 @@ class Potsdam2D(VisionDataset):
     .. versionadded:: 0.2
     """  # noqa: E501
 
-    filenames = ["4_Ortho_RGBIR.zip", "5_Labels_all.zip"]
-    md5s = ["c4a8f7d8c7196dd4eba4addd0aae10c1", "cf7403c1a97c0d279414db"]
+    filenames = ("4_Ortho_RGBIR.zip", "5_Labels_all.zip")
+    md5s = ("c4a8f7d8c7196dd4eba4addd0aae10c1", "cf7403c1a97c0d279414db")
     image_root = "4_Ortho_RGBIR"
     splits = {
-        "train": [
+        "train": (
             "top_potsdam_2_10",
             "top_potsdam_2_11",
             "top_potsdam_2_12",
@@ -82,8 +115,8 @@ class Potsdam2D(VisionDataset):
             "top_potsdam_7_7",
             "top_potsdam_7_8",
             "top_potsdam_7_9",
-        ],
-        "test": [
+        ),
+        "test": (
             "top_potsdam_5_15",
             "top_potsdam_6_15",
             "top_potsdam_6_13",
@@ -98,7 +131,7 @@ class Potsdam2D(VisionDataset):
             "top_potsdam_4_13",
             "top_potsdam_3_14",
             "top_potsdam_7_13",
-        ],
+        ),
     }
     classes = [
         "Clutter/background",
@@ -123,6 +156,8 @@ class Potsdam2D(VisionDataset):
         split: str = "train",
         transforms: Optional[Callable[[Dict[str, Tensor]], Dict[str, Tensor]]] = None,
         checksum: bool = False,
+        cache: bool = False,
+        bands: Sequence[int] = (1, 2, 3, 4),
     ) -> None:
         """Initialize a new Potsdam dataset instance.
 
@@ -132,33 +167,57 @@ class Potsdam2D(VisionDataset):
             transforms: a function/transform that takes input sample and its target as
                 entry and returns a transformed version
             checksum: if True, check the MD5 of the downloaded files (may be slow)
+            cache: if True, save decoded images and masks as ``.npy`` files next to
+                the original files and memory-map them afterwards. Masks are
+                converted to class indices once, during initialization
+            bands: image bands to load (1-indexed), e.g. ``(1, 2, 3)`` to only read
+                the RGB bands of the RGBIR images
         """
         assert split in self.splits
         self.root = root
         self.split = split
         self.transforms = transforms
         self.checksum = checksum
+        self.cache = cache
+        self.bands = bands
 
         self._verify()
 
+        # List each directory once instead of stat-ing every file
+        images = {e.name for e in os.scandir(os.path.join(root, self.image_root))}
+        masks = {e.name for e in os.scandir(root)}
+
         self.files = []
         for name in self.splits[split]:
-            image = os.path.join(root, self.image_root, name) + "_RGBIR.tif"
-            mask = os.path.join(root, name) + "_label.tif"
-            if os.path.exists(image) and os.path.exists(mask):
+            if f"{name}_RGBIR.tif" in images and f"{name}_label.tif" in masks:
+                image = os.path.join(root, self.image_root, name) + "_RGBIR.tif"
+                mask = os.path.join(root, name) + "_label.tif"
                 self.files.append(dict(image=image, mask=mask))
 
-    def __getitem__(self, index: int) -> Dict[str, Tensor]:
+        if self.cache:
+            self._cache_targets()
+
+    def __getitem__(self, index: Union[int, Tuple[int, Window]]) -> Dict[str, Tensor]:
         """Return an index within the dataset.
 
         Args:
-            index: index to return
+            index: index to return, or a tuple of an index and a pixel window to
+                only read that part of the image and mask
 
         Returns:
             data and label at that index
+
+        Raises:
+            ValueError: if the window extends past the image
         """
-        image = self._load_image(index)
-        mask = self._load_target(index)
+        window: Optional[Window] = None
+        if isinstance(index, tuple):
+            index, window = index
+
+        # Decode the image in a background thread while decoding the mask here
+        future = _get_io_pool().submit(self._load_image, index, window)
+        mask = self._load_target(index, window)
+        image = future.result()
         sample = {"image": image, "mask": mask}
 
         if self.transforms is not None:
@@ -174,39 +233,93 @@ class Potsdam2D(VisionDataset):
         """
         return len(self.files)
 
-    def _load_image(self, index: int) -> Tensor:
+    def _load_image(self, index: int, window: Optional[Window] = None) -> Tensor:
         """Load a single image.
 
         Args:
             index: index to return
+            window: optional pixel window to read instead of the whole image
 
         Returns:
             the image
         """
         path = self.files[index]["image"]
-        with rasterio.open(path) as f:
-            array = f.read()
-            tensor: Tensor = torch.from_numpy(array)  # type: ignore[attr-defined]
-            return tensor
+        if self.cache:
+            cache_path = os.path.splitext(path)[0] + ".npy"
+            if not os.path.exists(cache_path):
+                with rasterio.open(path) as f:
+                    _save_npy(cache_path, f.read())
+            array = np.load(cache_path, mmap_mode="c")
+            if window is not None:
+                rows, cols = _check_window(window, *array.shape[1:]).toslices()
+                array = array[:, rows, cols]
+            indexes = [band - 1 for band in self.bands]
+            if indexes != list(range(len(array))):
+                array = array[indexes]
+        else:
+            with rasterio.open(path) as f:
+                if window is not None:
+                    window = _check_window(window, f.height, f.width)
+                array = f.read(indexes=list(self.bands), window=window)
+        tensor: Tensor = torch.from_numpy(  # type: ignore[attr-defined]
+            np.asarray(array)
+        )
+        return tensor
 
-    def _load_target(self, index: int) -> Tensor:
+    def _load_target(self, index: int, window: Optional[Window] = None) -> Tensor:
         """Load the target mask for a single image.
 
         Args:
             index: index to return
+            window: optional pixel window to read instead of the whole mask
 
         Returns:
-            the target mask
+            the target mask as a uint8 tensor of class indices
         """
         path = self.files[index]["mask"]
-        with Image.open(path) as img:
-            array = np.array(img.convert("RGB"))
-            array = rgb_to_mask(array, self.colormap)
-            tensor: Tensor = torch.from_numpy(array)  # type: ignore[attr-defined]
-            # Convert from HxWxC to CxHxW
-            tensor = tensor.to(torch.long)  # type: ignore[attr-defined]
+        if self.cache:
+            array = np.load(os.path.splitext(path)[0] + ".npy", mmap_mode="c")
+            if window is not None:
+                rows, cols = _check_window(window, *array.shape).toslices()
+                array = array[rows, cols]
+        else:
+            array = self._decode_target(path, window)
+        tensor: Tensor = torch.from_numpy(  # type: ignore[attr-defined]
+            np.asarray(array)
+        )
         return tensor
 
+    def _decode_target(
+        self, path: str, window: Optional[Window] = None
+    ) -> np.ndarray:  # type: ignore[type-arg]
+        """Convert an RGB target mask to a mask of class indices.
+
+        Args:
+            path: path to the RGB target mask
+            window: optional pixel window to read instead of the whole mask
+
+        Returns:
+            the target mask
+        """
+        with rasterio.open(path) as f:
+            if window is not None:
+                window = _check_window(window, f.height, f.width)
+            array = f.read(window=window)
+        # Convert from CxHxW to HxWxC (a view, each band stays contiguous)
+        return rgb_to_mask(array.transpose(1, 2, 0), self.colormap)
+
+    def _cache_targets(self) -> None:
+        """Convert all target masks to class indices and save them as ``.npy``."""
+
+        def cache_target(path: str) -> None:
+            cache_path = os.path.splitext(path)[0] + ".npy"
+            if not os.path.exists(cache_path):
+                _save_npy(cache_path, self._decode_target(path))
+
+        # Decoding and indexing release the GIL, so convert several masks at once
+        paths = [files["mask"] for files in self.files]
+        list(_get_io_pool().map(cache_target, paths))
+
     def _verify(self) -> None:
         """Verify the integrity of the dataset.
 
@@ -218,16 +331,16 @@ class Potsdam2D(VisionDataset):
             return
 
         # Check if .zip files already exists (if so extract)
-        exists = []
-        for filename, md5 in zip(self.filenames, self.md5s):
-            filepath = os.path.join(self.root, filename)
-            if os.path.isfile(filepath):
-                if self.checksum and not check_integrity(filepath, md5):
-                    raise RuntimeError("Dataset found, but corrupted.")
-                exists.append(True)
-                extract_archive(filepath)
-            else:
-                exists.append(False)
+        filepaths = [os.path.join(self.root, filename) for filename in self.filenames]
+        exists = [os.path.isfile(filepath) for filepath in filepaths]
+        present = [(p, md5) for p, md5, e in zip(filepaths, self.md5s, exists) if e]
+        if self.checksum:
+            # Hash the archives concurrently, hashlib releases the GIL
+            integrity = _get_io_pool().map(lambda args: check_integrity(*args), present)
+            if not all(integrity):
+                raise RuntimeError("Dataset found, but corrupted.")
+        for filepath, _ in present:
+            extract_archive(filepath)
 
         if all(exists):
             return
@@ -256,9 +369,14 @@ class Potsdam2D(VisionDataset):
         Returns:
             a matplotlib Figure with the rendered sample
         """
+        image = sample["image"][:3]
+        # Images normalized by the DataModule are drawn in their original uint8 form
+        if image.is_floating_point():
+            image = (image * 255).to(torch.uint8)  # type: ignore[attr-defined]
+
         ncols = 1
         image1 = draw_semantic_segmentation_masks(
-            sample["image"][:3],
+            image,
             sample["mask"],
             alpha=alpha,
             colors=self.colormap,  # type: ignore[arg-type]
@@ -266,7 +384,7 @@ class Potsdam2D(VisionDataset):
         if "prediction" in sample:
             ncols += 1
             image2 = draw_semantic_segmentation_masks(
-                sample["image"][:3],
+                image,
                 sample["prediction"],
                 alpha=alpha,
                 colors=self.colormap,  # type: ignore[arg-type]
@@ -307,8 +425,9 @@ class Potsdam2DDataModule(pl.LightningDataModule):
         self,
         root_dir: str,
         batch_size: int = 64,
-        num_workers: int = 0,
+        num_workers: int = 8,
         val_split_pct: float = 0.2,
+        bands: Sequence[int] = (1, 2, 3, 4),
         **kwargs: Any,
     ) -> None:
         """Initialize a LightningDataModule for Potsdam2D based DataLoaders.
@@ -318,25 +437,14 @@ class Potsdam2DDataModule(pl.LightningDataModule):
             batch_size: The batch size to use in all created DataLoaders
             num_workers: The number of workers to use in all created DataLoaders
             val_split_pct: What percentage of the dataset to use as a validation set
+            bands: The ``bands`` argument to pass to the Potsdam2D Dataset classes
         """
         super().__init__()  # type: ignore[no-untyped-call]
         self.root_dir = root_dir
         self.batch_size = batch_size
         self.num_workers = num_workers
         self.val_split_pct = val_split_pct
-
-    def preprocess(self, sample: Dict[str, Any]) -> Dict[str, Any]:
-        """Transform a single sample from the Dataset.
-
-        Args:
-            sample: input image dictionary
-
-        Returns:
-            preprocessed sample
-        """
-        sample["image"] = sample["image"].float()
-        sample["image"] /= 255.0
-        return sample
+        self.bands = bands
 
     def setup(self, stage: Optional[str] = None) -> None:
         """Initialize the main ``Dataset`` objects.
@@ -346,9 +454,7 @@ class Potsdam2DDataModule(pl.LightningDataModule):
         Args:
             stage: stage to set up
         """
-        transforms = Compose([self.preprocess])
-
-        dataset = Potsdam2D(self.root_dir, "train", transforms=transforms)
+        dataset = Potsdam2D(self.root_dir, "train", bands=self.bands)
 
         if self.val_split_pct > 0.0:
             self.train_dataset, self.val_dataset, _ = dataset_split(
@@ -358,7 +464,41 @@ class Potsdam2DDataModule(pl.LightningDataModule):
             self.train_dataset = dataset  # type: ignore[assignment]
             self.val_dataset = None  # type: ignore[assignment]
 
-        self.test_dataset = Potsdam2D(self.root_dir, "test", transforms=transforms)
+        self.test_dataset = Potsdam2D(self.root_dir, "test", bands=self.bands)
+
+    def on_after_batch_transfer(
+        self, batch: Dict[str, Any], dataloader_idx: int
+    ) -> Dict[str, Any]:
+        """Normalize a batch of images after it is transferred to the device.
+
+        Images and masks are kept as uint8 in the DataLoader workers so that fewer
+        bytes are collated and copied to the device. Masks are cast to long here
+        as required by the loss functions.
+
+        Args:
+            batch: mini-batch of data
+            dataloader_idx: index of the dataloader the batch belongs to
+
+        Returns:
+            normalized mini-batch
+        """
+        batch["image"] = batch["image"].float()
+        batch["image"] /= 255.0
+        batch["mask"] = batch["mask"].long()
+        return batch
+
+    def _worker_kwargs(self) -> Dict[str, Any]:
+        """Return the DataLoader arguments that are only valid with worker processes.
+
+        These are built for each DataLoader so that later changes to
+        ``num_workers`` are respected.
+
+        Returns:
+            keyword arguments to pass to the DataLoader
+        """
+        if self.num_workers > 0:
+            return dict(persistent_workers=True, prefetch_factor=4)
+        return {}
 
     def train_dataloader(self) -> DataLoader[Any]:
         """Return a DataLoader for training.
@@ -370,7 +510,9 @@ class Potsdam2DDataModule(pl.LightningDataModule):
             self.train_dataset,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
+            pin_memory=True,
             shuffle=True,
+            **self._worker_kwargs(),
         )
 
     def val_dataloader(self) -> DataLoader[Any]:
@@ -379,15 +521,20 @@ class Potsdam2DDataModule(pl.LightningDataModule):
         Returns:
             validation data loader
         """
+        # Validate on the training set without shuffling if there is no val split
         if self.val_split_pct == 0.0:
-            return self.train_dataloader()
+            dataset = self.train_dataset
         else:
-            return DataLoader(
-                self.val_dataset,
-                batch_size=self.batch_size,
-                num_workers=self.num_workers,
-                shuffle=False,
-            )
+            dataset = self.val_dataset
+
+        return DataLoader(
+            dataset,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            pin_memory=True,
+            shuffle=False,
+            **self._worker_kwargs(),
+        )
 
     def test_dataloader(self) -> DataLoader[Any]:
         """Return a DataLoader for testing.
@@ -399,5 +546,7 @@ class Potsdam2DDataModule(pl.LightningDataModule):
             self.test_dataset,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
+            pin_memory=True,
             shuffle=False,
+            **self._worker_kwargs(),
         )
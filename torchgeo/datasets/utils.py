@@ -6,12 +6,16 @@
 import bz2
 import collections
 import contextlib
+import functools
 import gzip
 import lzma
 import os
+import shutil
 import sys
 import tarfile
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import (
@@ -58,6 +62,9 @@ __all__ = (
 
 ColorMap = Union[List[Union[str, Tuple[int, int, int]]], str, Tuple[int, int, int]]
 
+_io_pool: Optional[ThreadPoolExecutor] = None
+_io_pool_pid: Optional[int] = None
+
 
 class _rarfile:
     class RarFile:
@@ -81,6 +88,44 @@ class _rarfile:
             pass
 
 
+def _get_io_pool() -> ThreadPoolExecutor:
+    """Return a thread pool for overlapping file reads and decoding.
+
+    The pool is created lazily and re-created in forked processes (e.g.
+    DataLoader workers), where the copy of the parent's pool has no threads.
+
+    Returns:
+        the thread pool of the current process
+    """
+    global _io_pool, _io_pool_pid
+    if _io_pool is None or _io_pool_pid != os.getpid():
+        _io_pool = ThreadPoolExecutor(max_workers=4)
+        _io_pool_pid = os.getpid()
+    return _io_pool
+
+
+def _save_npy(path: str, array: np.ndarray) -> None:  # type: ignore[type-arg]
+    """Atomically save an array to a ``.npy`` file.
+
+    The array is written to a temporary file in the same directory and renamed into
+    place, so concurrent readers (e.g. other DataLoader workers or DDP ranks) never
+    see a partially written file, and an interrupted write leaves no ``.npy`` file.
+
+    Args:
+        path: path of the ``.npy`` file to write
+        array: array to save
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def extract_archive(src: str, dst: Optional[str] = None) -> None:
     """Extract an archive.
 
@@ -119,7 +164,7 @@ def extract_archive(src: str, dst: Optional[str] = None) -> None:
         if src.endswith(suffix):
             dst = os.path.join(dst, os.path.basename(src).replace(suffix, ""))
             with decompressor(src, "rb") as sf, open(dst, "wb") as df:
-                df.write(sf.read())
+                shutil.copyfileobj(sf, df, 1 << 20)
             return
 
     raise RuntimeError("src file has unknown archival/compression scheme")
@@ -576,25 +621,52 @@ def draw_semantic_segmentation_masks(
     return img  # type: ignore[no-any-return]
 
 
+@functools.lru_cache()
+def _rgb_lut(
+    colors: Tuple[Tuple[int, int, int], ...]
+) -> np.ndarray:  # type: ignore[type-arg]
+    """Build a lookup table from packed 24-bit RGB values to class indices.
+
+    Args:
+        colors: RGB tuples to convert to integer indices
+
+    Returns:
+        read-only lookup table of length 2**24, 0 for colors not in ``colors``
+    """
+    lut = np.zeros(1 << 24, dtype=np.uint8)
+    for i, (r, g, b) in enumerate(colors):
+        lut[(r << 16) | (g << 8) | b] = i
+    lut.flags.writeable = False
+    return lut
+
+
 def rgb_to_mask(
     rgb: np.ndarray, colors: List[Tuple[int, int, int]]  # type: ignore[type-arg]
 ) -> np.ndarray:  # type: ignore[type-arg]
     """Converts an RGB colormap mask to a integer mask.
 
     Args:
-        rgb: array mask of coded with RGB tuples
+        rgb: array mask of coded with RGB tuples, any dtype (uint8 is fastest)
         colors: list of RGB tuples to convert to integer indices
 
     Returns:
-        integer array mask
+        integer array mask, 0 for pixels that do not match any color
     """
-    h, w = rgb.shape[:2]
-    mask = np.zeros(shape=(h, w), dtype=np.uint8)
-    for i, c in enumerate(colors):
-        cmask = rgb == c
-        # Only update mask if class is present in mask
-        if isinstance(cmask, np.ndarray):
-            mask[cmask.all(axis=-1)] = i
+    valid = None
+    if rgb.dtype != np.uint8:
+        # Pixels that are not valid 8-bit colors cannot match any color
+        valid = np.all((rgb >= 0) & (rgb <= 255) & (rgb == np.floor(rgb)), axis=-1)
+        rgb = rgb.astype(np.uint8)
+
+    # Pack each RGB triple into a single uint32 so that the class index of every
+    # pixel can be found with a single lookup table indexing pass
+    packed = rgb[..., 0].astype(np.uint32) << 16
+    packed |= rgb[..., 1].astype(np.uint32) << 8
+    packed |= rgb[..., 2]
+    lut = _rgb_lut(tuple(tuple(c) for c in colors))
+    mask: np.ndarray = lut[packed]  # type: ignore[type-arg]
+    if valid is not None:
+        mask[~valid] = 0
     return mask
 
 
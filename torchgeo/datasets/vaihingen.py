@@ -9,16 +9,22 @@ from typing import Any, Callable, Dict, Optional
 import matplotlib.pyplot as plt
 import numpy as np
 import pytorch_lightning as pl
+import rasterio
 import torch
 from matplotlib.figure import Figure
 from PIL import Image
 from torch import Tensor
 from torch.utils.data import DataLoader
-from torchvision.transforms import Compose
 
 from ..datasets.utils import dataset_split, draw_semantic_segmentation_masks
 from .geo import VisionDataset
-from .utils import check_integrity, extract_archive, rgb_to_mask
+from .utils import (
+    _get_io_pool,
+    _save_npy,
+    check_integrity,
+    extract_archive,
+    rgb_to_mask,
+)
 
 
 class Vaihingen2D(VisionDataset):
@@ -53,14 +59,14 @@ class Vaihingen2D(VisionDataset):
     .. versionadded: 0.2
     """  # noqa: E501
 
-    filenames = [
+    filenames = (
         "ISPRS_semantic_labeling_Vaihingen.zip",
         "ISPRS_semantic_labeling_Vaihingen_ground_truth_COMPLETE.zip",
-    ]
-    md5s = ["462b8dca7b6fa9eaf729840f0cdfc7f3", "4802dd6326e2727a352fb735be450277"]
+    )
+    md5s = ("462b8dca7b6fa9eaf729840f0cdfc7f3", "4802dd6326e2727a352fb735be450277")
     image_root = "top"
     splits = {
-        "train": [
+        "train": (
             "top_mosaic_09cm_area1.tif",
             "top_mosaic_09cm_area11.tif",
             "top_mosaic_09cm_area13.tif",
@@ -77,8 +83,8 @@ class Vaihingen2D(VisionDataset):
             "top_mosaic_09cm_area37.tif",
             "top_mosaic_09cm_area5.tif",
             "top_mosaic_09cm_area7.tif",
-        ],
-        "test": [
+        ),
+        "test": (
             "top_mosaic_09cm_area6.tif",
             "top_mosaic_09cm_area24.tif",
             "top_mosaic_09cm_area35.tif",
@@ -96,7 +102,7 @@ class Vaihingen2D(VisionDataset):
             "top_mosaic_09cm_area38.tif",
             "top_mosaic_09cm_area12.tif",
             "top_mosaic_09cm_area29.tif",
-        ],
+        ),
     }
     classes = [
         "Clutter/background",
@@ -121,6 +127,7 @@ class Vaihingen2D(VisionDataset):
         split: str = "train",
         transforms: Optional[Callable[[Dict[str, Tensor]], Dict[str, Tensor]]] = None,
         checksum: bool = False,
+        cache: bool = False,
     ) -> None:
         """Initialize a new Vaihingen2D dataset instance.
 
@@ -130,22 +137,33 @@ class Vaihingen2D(VisionDataset):
             transforms: a function/transform that takes input sample and its target as
                 entry and returns a transformed version
             checksum: if True, check the MD5 of the downloaded files (may be slow)
+            cache: if True, save decoded images and masks as ``.npy`` files next to
+                the original files and memory-map them afterwards. Masks are
+                converted to class indices once, during initialization
         """
         assert split in self.splits
         self.root = root
         self.split = split
         self.transforms = transforms
         self.checksum = checksum
+        self.cache = cache
 
         self._verify()
 
+        # List each directory once instead of stat-ing every file
+        images = {e.name for e in os.scandir(os.path.join(root, self.image_root))}
+        masks = {e.name for e in os.scandir(root)}
+
         self.files = []
         for name in self.splits[split]:
-            image = os.path.join(root, self.image_root, name)
-            mask = os.path.join(root, name)
-            if os.path.exists(image) and os.path.exists(mask):
+            if name in images and name in masks:
+                image = os.path.join(root, self.image_root, name)
+                mask = os.path.join(root, name)
                 self.files.append(dict(image=image, mask=mask))
 
+        if self.cache:
+            self._cache_targets()
+
     def __getitem__(self, index: int) -> Dict[str, Tensor]:
         """Return an index within the dataset.
 
@@ -155,8 +173,10 @@ class Vaihingen2D(VisionDataset):
         Returns:
             data and label at that index
         """
-        image = self._load_image(index)
+        # Decode the image in a background thread while decoding the mask here
+        future = _get_io_pool().submit(self._load_image, index)
         mask = self._load_target(index)
+        image = future.result()
         sample = {"image": image, "mask": mask}
 
         if self.transforms is not None:
@@ -182,11 +202,19 @@ class Vaihingen2D(VisionDataset):
             the image
         """
         path = self.files[index]["image"]
-        with Image.open(path) as img:
-            array = np.array(img.convert("RGB"))
-            tensor: Tensor = torch.from_numpy(array)  # type: ignore[attr-defined]
+        cache_path = os.path.splitext(path)[0] + ".npy"
+        if self.cache and os.path.exists(cache_path):
+            array = np.load(cache_path, mmap_mode="c")
+        else:
+            with Image.open(path) as img:
+                array = np.array(img.convert("RGB"))
             # Convert from HxWxC to CxHxW
-            tensor = tensor.permute((2, 0, 1))
+            array = array.transpose((2, 0, 1))
+            if self.cache:
+                _save_npy(cache_path, array)
+        tensor: Tensor = torch.from_numpy(  # type: ignore[attr-defined]
+            np.asarray(array)
+        )
         return tensor
 
     def _load_target(self, index: int) -> Tensor:
@@ -196,17 +224,44 @@ class Vaihingen2D(VisionDataset):
             index: index to return
 
         Returns:
-            the target mask
+            the target mask as a uint8 tensor of class indices
         """
         path = self.files[index]["mask"]
-        with Image.open(path) as img:
-            array = np.array(img.convert("RGB"))
-            array = rgb_to_mask(array, self.colormap)
-            tensor: Tensor = torch.from_numpy(array)  # type: ignore[attr-defined]
-            # Convert from HxWxC to CxHxW
-            tensor = tensor.to(torch.long)  # type: ignore[attr-defined]
+        if self.cache:
+            array = np.load(os.path.splitext(path)[0] + ".npy", mmap_mode="c")
+        else:
+            array = self._decode_target(path)
+        tensor: Tensor = torch.from_numpy(  # type: ignore[attr-defined]
+            np.asarray(array)
+        )
         return tensor
 
+    def _decode_target(self, path: str) -> np.ndarray:  # type: ignore[type-arg]
+        """Convert an RGB target mask to a mask of class indices.
+
+        Args:
+            path: path to the RGB target mask
+
+        Returns:
+            the target mask
+        """
+        with rasterio.open(path) as f:
+            array = f.read()
+        # Convert from CxHxW to HxWxC (a view, each band stays contiguous)
+        return rgb_to_mask(array.transpose(1, 2, 0), self.colormap)
+
+    def _cache_targets(self) -> None:
+        """Convert all target masks to class indices and save them as ``.npy``."""
+
+        def cache_target(path: str) -> None:
+            cache_path = os.path.splitext(path)[0] + ".npy"
+            if not os.path.exists(cache_path):
+                _save_npy(cache_path, self._decode_target(path))
+
+        # Decoding and indexing release the GIL, so convert several masks at once
+        paths = [files["mask"] for files in self.files]
+        list(_get_io_pool().map(cache_target, paths))
+
     def _verify(self) -> None:
         """Verify the integrity of the dataset.
 
@@ -218,16 +273,16 @@ class Vaihingen2D(VisionDataset):
             return
 
         # Check if .zip files already exists (if so extract)
-        exists = []
-        for filename, md5 in zip(self.filenames, self.md5s):
-            filepath = os.path.join(self.root, filename)
-            if os.path.isfile(filepath):
-                if self.checksum and not check_integrity(filepath, md5):
-                    raise RuntimeError("Dataset found, but corrupted.")
-                exists.append(True)
-                extract_archive(filepath)
-            else:
-                exists.append(False)
+        filepaths = [os.path.join(self.root, filename) for filename in self.filenames]
+        exists = [os.path.isfile(filepath) for filepath in filepaths]
+        present = [(p, md5) for p, md5, e in zip(filepaths, self.md5s, exists) if e]
+        if self.checksum:
+            # Hash the archives concurrently, hashlib releases the GIL
+            integrity = _get_io_pool().map(lambda args: check_integrity(*args), present)
+            if not all(integrity):
+                raise RuntimeError("Dataset found, but corrupted.")
+        for filepath, _ in present:
+            extract_archive(filepath)
 
         if all(exists):
             return
@@ -256,9 +311,14 @@ class Vaihingen2D(VisionDataset):
         Returns:
             a matplotlib Figure with the rendered sample
         """
+        image = sample["image"][:3]
+        # Images normalized by the DataModule are drawn in their original uint8 form
+        if image.is_floating_point():
+            image = (image * 255).to(torch.uint8)  # type: ignore[attr-defined]
+
         ncols = 1
         image1 = draw_semantic_segmentation_masks(
-            sample["image"][:3],
+            image,
             sample["mask"],
             alpha=alpha,
             colors=self.colormap,  # type: ignore[arg-type]
@@ -266,7 +326,7 @@ class Vaihingen2D(VisionDataset):
         if "prediction" in sample:
             ncols += 1
             image2 = draw_semantic_segmentation_masks(
-                sample["image"][:3],
+                image,
                 sample["prediction"],
                 alpha=alpha,
                 colors=self.colormap,  # type: ignore[arg-type]
@@ -307,7 +367,7 @@ class Vaihingen2DDataModule(pl.LightningDataModule):
         self,
         root_dir: str,
         batch_size: int = 64,
-        num_workers: int = 0,
+        num_workers: int = 8,
         val_split_pct: float = 0.2,
         **kwargs: Any,
     ) -> None:
@@ -325,19 +385,6 @@ class Vaihingen2DDataModule(pl.LightningDataModule):
         self.num_workers = num_workers
         self.val_split_pct = val_split_pct
 
-    def preprocess(self, sample: Dict[str, Any]) -> Dict[str, Any]:
-        """Transform a single sample from the Dataset.
-
-        Args:
-            sample: input image dictionary
-
-        Returns:
-            preprocessed sample
-        """
-        sample["image"] = sample["image"].float()
-        sample["image"] /= 255.0
-        return sample
-
     def setup(self, stage: Optional[str] = None) -> None:
         """Initialize the main ``Dataset`` objects.
 
@@ -346,9 +393,7 @@ class Vaihingen2DDataModule(pl.LightningDataModule):
         Args:
             stage: stage to set up
         """
-        transforms = Compose([self.preprocess])
-
-        dataset = Vaihingen2D(self.root_dir, "train", transforms=transforms)
+        dataset = Vaihingen2D(self.root_dir, "train")
 
         if self.val_split_pct > 0.0:
             self.train_dataset, self.val_dataset, _ = dataset_split(
@@ -358,7 +403,41 @@ class Vaihingen2DDataModule(pl.LightningDataModule):
             self.train_dataset = dataset  # type: ignore[assignment]
             self.val_dataset = None  # type: ignore[assignment]
 
-        self.test_dataset = Vaihingen2D(self.root_dir, "test", transforms=transforms)
+        self.test_dataset = Vaihingen2D(self.root_dir, "test")
+
+    def on_after_batch_transfer(
+        self, batch: Dict[str, Any], dataloader_idx: int
+    ) -> Dict[str, Any]:
+        """Normalize a batch of images after it is transferred to the device.
+
+        Images and masks are kept as uint8 in the DataLoader workers so that fewer
+        bytes are collated and copied to the device. Masks are cast to long here
+        as required by the loss functions.
+
+        Args:
+            batch: mini-batch of data
+            dataloader_idx: index of the dataloader the batch belongs to
+
+        Returns:
+            normalized mini-batch
+        """
+        batch["image"] = batch["image"].float()
+        batch["image"] /= 255.0
+        batch["mask"] = batch["mask"].long()
+        return batch
+
+    def _worker_kwargs(self) -> Dict[str, Any]:
+        """Return the DataLoader arguments that are only valid with worker processes.
+
+        These are built for each DataLoader so that later changes to
+        ``num_workers`` are respected.
+
+        Returns:
+            keyword arguments to pass to the DataLoader
+        """
+        if self.num_workers > 0:
+            return dict(persistent_workers=True, prefetch_factor=4)
+        return {}
 
     def train_dataloader(self) -> DataLoader[Any]:
         """Return a DataLoader for training.
@@ -370,7 +449,9 @@ class Vaihingen2DDataModule(pl.LightningDataModule):
             self.train_dataset,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
+            pin_memory=True,
             shuffle=True,
+            **self._worker_kwargs(),
         )
 
     def val_dataloader(self) -> DataLoader[Any]:
@@ -379,15 +460,20 @@ class Vaihingen2DDataModule(pl.LightningDataModule):
         Returns:
             validation data loader
         """
+        # Validate on the training set without shuffling if there is no val split
         if self.val_split_pct == 0.0:
-            return self.train_dataloader()
+            dataset = self.train_dataset
         else:
-            return DataLoader(
-                self.val_dataset,
-                batch_size=self.batch_size,
-                num_workers=self.num_workers,
-                shuffle=False,
-            )
+            dataset = self.val_dataset
+
+        return DataLoader(
+            dataset,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            pin_memory=True,
+            shuffle=False,
+            **self._worker_kwargs(),
+        )
 
     def test_dataloader(self) -> DataLoader[Any]:
         """Return a DataLoader for testing.
@@ -399,5 +485,7 @@ class Vaihingen2DDataModule(pl.LightningDataModule):
             self.test_dataset,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
+            pin_memory=True,
             shuffle=False,
+            **self._worker_kwargs(),
         )
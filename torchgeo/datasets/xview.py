@@ -3,7 +3,6 @@
 
 """xView2 dataset."""
 
-import glob
 import os
 from typing import Any, Callable, Dict, List, Optional
 
@@ -14,11 +13,10 @@ import torch
 from PIL import Image
 from torch import Tensor
 from torch.utils.data import DataLoader
-from torchvision.transforms import Compose
 
 from ..datasets.utils import dataset_split, draw_semantic_segmentation_masks
 from .geo import VisionDataset
-from .utils import check_integrity, extract_archive
+from .utils import _get_io_pool, _save_npy, check_integrity, extract_archive
 
 
 class XView2(VisionDataset):
@@ -72,6 +70,7 @@ class XView2(VisionDataset):
         split: str = "train",
         transforms: Optional[Callable[[Dict[str, Tensor]], Dict[str, Tensor]]] = None,
         checksum: bool = False,
+        cache: bool = False,
     ) -> None:
         """Initialize a new xView2 dataset instance.
 
@@ -81,18 +80,27 @@ class XView2(VisionDataset):
             transforms: a function/transform that takes input sample and its target as
                 entry and returns a transformed version
             checksum: if True, check the MD5 of the downloaded files (may be slow)
+            cache: if True, save decoded images and masks as ``.npy`` files next to
+                the original files on first access and load them afterwards
         """
         assert split in self.metadata
         self.root = root
         self.split = split
         self.transforms = transforms
         self.checksum = checksum
+        self.cache = cache
 
         self._verify()
 
         self.class2idx = {c: i for i, c in enumerate(self.classes)}
         self.files = self._load_files(root, split)
 
+        # All xView2 tiles have the same size, so only read it from the first header
+        self.size = (0, 0)
+        if self.files:
+            with Image.open(self.files[0]["image1"]) as img:
+                self.size = img.size
+
     def __getitem__(self, index: int) -> Dict[str, Tensor]:
         """Return an index within the dataset.
 
@@ -103,13 +111,26 @@ class XView2(VisionDataset):
             data and label at that index
         """
         files = self.files[index]
-        image1 = self._load_image(files["image1"])
-        image2 = self._load_image(files["image2"])
-        mask1 = self._load_target(files["mask1"])
-        mask2 = self._load_target(files["mask2"])
+        width, height = self.size
 
-        image = torch.stack(tensors=[image1, image2], dim=0)
-        mask = torch.stack(tensors=[mask1, mask2], dim=0)
+        # Decode the pre and post disaster pairs directly into the stacked outputs
+        image: Tensor = torch.empty(  # type: ignore[attr-defined]
+            (2, 3, height, width), dtype=torch.uint8  # type: ignore[attr-defined]
+        )
+        mask: Tensor = torch.empty(  # type: ignore[attr-defined]
+            (2, height, width), dtype=torch.uint8  # type: ignore[attr-defined]
+        )
+        # Decode three of the files in background threads while decoding the last
+        # one here, Pillow releases the GIL while decoding
+        pool = _get_io_pool()
+        futures = [
+            pool.submit(self._load_image, files["image1"], image[0]),
+            pool.submit(self._load_image, files["image2"], image[1]),
+            pool.submit(self._load_target, files["mask1"], mask[0]),
+        ]
+        self._load_target(files["mask2"], out=mask[1])
+        for future in futures:
+            future.result()
         sample = {"image": image, "mask": mask}
 
         if self.transforms is not None:
@@ -139,10 +160,15 @@ class XView2(VisionDataset):
         directory = self.metadata[split]["directory"]
         image_root = os.path.join(root, directory, "images")
         mask_root = os.path.join(root, directory, "targets")
-        images = glob.glob(os.path.join(image_root, "*.png"))
-        basenames = [os.path.basename(f) for f in images]
-        basenames = ["_".join(f.split("_")[:-2]) for f in basenames]
-        for name in set(basenames):
+        # Strip the "_{pre,post}_disaster.png" suffix to get the name of each pair,
+        # sorting so that the order does not depend on the filesystem
+        filenames = sorted(
+            entry.name
+            for entry in os.scandir(image_root)
+            if entry.name.endswith(".png")
+        )
+        names = dict.fromkeys(filename.rsplit("_", 2)[0] for filename in filenames)
+        for name in names:
             image1 = os.path.join(image_root, f"{name}_pre_disaster.png")
             image2 = os.path.join(image_root, f"{name}_post_disaster.png")
             mask1 = os.path.join(mask_root, f"{name}_pre_disaster_target.png")
@@ -150,38 +176,59 @@ class XView2(VisionDataset):
             files.append(dict(image1=image1, image2=image2, mask1=mask1, mask2=mask2))
         return files
 
-    def _load_image(self, path: str) -> Tensor:
+    def _load_image(self, path: str, out: Optional[Tensor] = None) -> Tensor:
         """Load a single image.
 
         Args:
             path: path to the image
+            out: optional (3, h, w) uint8 tensor to decode the image into
 
         Returns:
             the image
         """
-        filename = os.path.join(path)
-        with Image.open(filename) as img:
-            array = np.array(img.convert("RGB"))
-            tensor: Tensor = torch.from_numpy(array)  # type: ignore[attr-defined]
-            # Convert from HxWxC to CxHxW
-            tensor = tensor.permute((2, 0, 1))
-            return tensor
-
-    def _load_target(self, path: str) -> Tensor:
+        cache_path = os.path.splitext(path)[0] + ".npy"
+        if self.cache and os.path.exists(cache_path):
+            array = np.load(cache_path, mmap_mode="r")
+        else:
+            with Image.open(path) as img:
+                # convert() copies the image even if it is already in the requested
+                # mode
+                array = np.asarray(img if img.mode == "RGB" else img.convert("RGB"))
+            # Convert from HxWxC to CxHxW, the copy happens when writing the output
+            array = array.transpose((2, 0, 1))
+            if self.cache:
+                _save_npy(cache_path, array)
+        if out is None:
+            out = torch.empty(  # type: ignore[attr-defined]
+                array.shape, dtype=torch.uint8  # type: ignore[attr-defined]
+            )
+        np.copyto(out.numpy(), array)
+        return out
+
+    def _load_target(self, path: str, out: Optional[Tensor] = None) -> Tensor:
         """Load the target mask for a single image.
 
         Args:
             path: path to the image
+            out: optional (h, w) uint8 tensor to decode the mask into
 
         Returns:
-            the target mask
+            the target mask as a uint8 tensor of class indices
         """
-        filename = os.path.join(path)
-        with Image.open(filename) as img:
-            array = np.array(img.convert("L"))
-            tensor: Tensor = torch.from_numpy(array)  # type: ignore[attr-defined]
-            tensor = tensor.to(torch.long)  # type: ignore[attr-defined]
-            return tensor
+        cache_path = os.path.splitext(path)[0] + ".npy"
+        if self.cache and os.path.exists(cache_path):
+            array = np.load(cache_path, mmap_mode="r")
+        else:
+            with Image.open(path) as img:
+                array = np.asarray(img if img.mode == "L" else img.convert("L"))
+            if self.cache:
+                _save_npy(cache_path, array)
+        if out is None:
+            out = torch.empty(  # type: ignore[attr-defined]
+                array.shape, dtype=torch.uint8  # type: ignore[attr-defined]
+            )
+        np.copyto(out.numpy(), array)
+        return out
 
     def _verify(self) -> None:
         """Verify the integrity of the dataset.
@@ -189,32 +236,25 @@ class XView2(VisionDataset):
         Raises:
             RuntimeError: if checksum fails or the dataset is not downloaded
         """
+        # Only the requested split is needed, and __getitem__ only reads the images
+        # and targets directories
+        split_info = self.metadata[self.split]
+
         # Check if the files already exist
         exists = []
-        for split_info in self.metadata.values():
-            for directory in ["images", "labels", "targets"]:
-                exists.append(
-                    os.path.exists(
-                        os.path.join(self.root, split_info["directory"], directory)
-                    )
-                )
+        for directory in ["images", "targets"]:
+            dirpath = os.path.join(self.root, split_info["directory"], directory)
+            exists.append(os.path.isdir(dirpath))
 
         if all(exists):
             return
 
-        # Check if .tar.gz files already exists (if so then extract)
-        exists = []
-        for split_info in self.metadata.values():
-            filepath = os.path.join(self.root, split_info["filename"])
-            if os.path.isfile(filepath):
-                if self.checksum and not check_integrity(filepath, split_info["md5"]):
-                    raise RuntimeError("Dataset found, but corrupted.")
-                exists.append(True)
-                extract_archive(filepath)
-            else:
-                exists.append(False)
-
-        if all(exists):
+        # Check if .tar.gz file already exists (if so then extract)
+        filepath = os.path.join(self.root, split_info["filename"])
+        if os.path.isfile(filepath):
+            if self.checksum and not check_integrity(filepath, split_info["md5"]):
+                raise RuntimeError("Dataset found, but corrupted.")
+            extract_archive(filepath)
             return
 
         # Check if the user requested to download the dataset
@@ -241,36 +281,28 @@ class XView2(VisionDataset):
         Returns:
             a matplotlib Figure with the rendered sample
         """
-        ncols = 2
-        image1 = draw_semantic_segmentation_masks(
-            sample["image"][0],
-            sample["mask"][0],
-            alpha=alpha,
-            colors=self.colormap,  # type: ignore[arg-type]
-        )
-        image2 = draw_semantic_segmentation_masks(
-            sample["image"][1],
-            sample["mask"][1],
-            alpha=alpha,
-            colors=self.colormap,  # type: ignore[arg-type]
-        )
+        # Render the overlays concurrently, torch ops release the GIL while blending
+        pairs = [(sample["image"][0], sample["mask"][0])]
+        pairs.append((sample["image"][1], sample["mask"][1]))
         if "prediction" in sample:  # NOTE: this assumes predictions are made for post
-            ncols += 1
-            image3 = draw_semantic_segmentation_masks(
-                sample["image"][1],
-                sample["prediction"],
+            pairs.append((sample["image"][1], sample["prediction"]))
+        ncols = len(pairs)
+        futures = [
+            _get_io_pool().submit(
+                draw_semantic_segmentation_masks,
+                image,
+                mask,
                 alpha=alpha,
                 colors=self.colormap,  # type: ignore[arg-type]
             )
+            for image, mask in pairs
+        ]
+        images = [future.result() for future in futures]
 
         fig, axs = plt.subplots(ncols=ncols, figsize=(ncols * 10, 10))
-        axs[0].imshow(image1)
-        axs[0].axis("off")
-        axs[1].imshow(image2)
-        axs[1].axis("off")
-        if ncols > 2:
-            axs[2].imshow(image3)
-            axs[2].axis("off")
+        for ax, image in zip(axs, images):
+            ax.imshow(image)
+            ax.axis("off")
 
         if show_titles:
             axs[0].set_title("Pre disaster")
@@ -296,8 +328,10 @@ class XView2DataModule(pl.LightningDataModule):
         self,
         root_dir: str,
         batch_size: int = 64,
-        num_workers: int = 0,
+        num_workers: int = 8,
         val_split_pct: float = 0.2,
+        cache: bool = False,
+        pack_masks: bool = False,
         **kwargs: Any,
     ) -> None:
         """Initialize a LightningDataModule for xView2 based DataLoaders.
@@ -307,25 +341,18 @@ class XView2DataModule(pl.LightningDataModule):
             batch_size: The batch size to use in all created DataLoaders
             num_workers: The number of workers to use in all created DataLoaders
             val_split_pct: What percentage of the dataset to use as a validation set
+            cache: The ``cache`` argument to pass to the xView2 Dataset classes
+            pack_masks: If True, pack two mask pixels into each byte in the
+                DataLoader workers and unpack them on the device, halving the size
+                of the masks that are collated and transferred
         """
         super().__init__()  # type: ignore[no-untyped-call]
         self.root_dir = root_dir
         self.batch_size = batch_size
         self.num_workers = num_workers
         self.val_split_pct = val_split_pct
-
-    def preprocess(self, sample: Dict[str, Any]) -> Dict[str, Any]:
-        """Transform a single sample from the Dataset.
-
-        Args:
-            sample: input image dictionary
-
-        Returns:
-            preprocessed sample
-        """
-        sample["image"] = sample["image"].float()
-        sample["image"] /= 255.0
-        return sample
+        self.cache = cache
+        self.pack_masks = pack_masks
 
     def setup(self, stage: Optional[str] = None) -> None:
         """Initialize the main ``Dataset`` objects.
@@ -335,9 +362,8 @@ class XView2DataModule(pl.LightningDataModule):
         Args:
             stage: stage to set up
         """
-        transforms = Compose([self.preprocess])
-
-        dataset = XView2(self.root_dir, "train", transforms=transforms)
+        transforms = self.pack if self.pack_masks else None
+        dataset = XView2(self.root_dir, "train", transforms, cache=self.cache)
 
         if self.val_split_pct > 0.0:
             self.train_dataset, self.val_dataset, _ = dataset_split(
@@ -347,7 +373,63 @@ class XView2DataModule(pl.LightningDataModule):
             self.train_dataset = dataset  # type: ignore[assignment]
             self.val_dataset = None  # type: ignore[assignment]
 
-        self.test_dataset = XView2(self.root_dir, "test", transforms=transforms)
+        self.test_dataset = XView2(self.root_dir, "test", transforms, cache=self.cache)
+
+    def pack(self, sample: Dict[str, Any]) -> Dict[str, Any]:
+        """Pack pairs of horizontally adjacent mask pixels into single bytes.
+
+        Class indices are less than 16, so each one fits in 4 bits. The even column
+        is stored in the high nibble and the odd column in the low nibble.
+
+        Args:
+            sample: input sample with a (2, h, w) uint8 mask, w must be even
+
+        Returns:
+            sample with a (2, h, w // 2) uint8 mask
+        """
+        mask = sample["mask"]
+        assert mask.shape[-1] % 2 == 0, f"Cannot pack masks of odd width {mask.shape}"
+        sample["mask"] = (mask[..., ::2] << 4) | mask[..., 1::2]
+        return sample
+
+    def on_after_batch_transfer(
+        self, batch: Dict[str, Any], dataloader_idx: int
+    ) -> Dict[str, Any]:
+        """Normalize a batch of images after it is transferred to the device.
+
+        Images and masks are kept as uint8 in the DataLoader workers so that fewer
+        bytes are collated and copied to the device. Masks packed by :meth:`pack`
+        are unpacked, and all masks are cast to long here as required by the loss
+        functions.
+
+        Args:
+            batch: mini-batch of data
+            dataloader_idx: index of the dataloader the batch belongs to
+
+        Returns:
+            normalized mini-batch
+        """
+        batch["image"] = batch["image"].float()
+        batch["image"] /= 255.0
+        mask = batch["mask"]
+        if self.pack_masks:
+            mask = torch.stack([mask >> 4, mask & 0x0F], dim=-1)
+            mask = mask.flatten(start_dim=-2)
+        batch["mask"] = mask.long()
+        return batch
+
+    def _worker_kwargs(self) -> Dict[str, Any]:
+        """Return the DataLoader arguments that are only valid with worker processes.
+
+        These are built for each DataLoader so that later changes to
+        ``num_workers`` are respected.
+
+        Returns:
+            keyword arguments to pass to the DataLoader
+        """
+        if self.num_workers > 0:
+            return dict(persistent_workers=True, prefetch_factor=4)
+        return {}
 
     def train_dataloader(self) -> DataLoader[Any]:
         """Return a DataLoader for training.
@@ -359,7 +441,10 @@ class XView2DataModule(pl.LightningDataModule):
             self.train_dataset,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
+            pin_memory=True,
             shuffle=True,
+            drop_last=True,
+            **self._worker_kwargs(),
         )
 
     def val_dataloader(self) -> DataLoader[Any]:
@@ -368,15 +453,20 @@ class XView2DataModule(pl.LightningDataModule):
         Returns:
             validation data loader
         """
+        # Validate on the training set without shuffling if there is no val split
         if self.val_split_pct == 0.0:
-            return self.train_dataloader()
+            dataset = self.train_dataset
         else:
-            return DataLoader(
-                self.val_dataset,
-                batch_size=self.batch_size,
-                num_workers=self.num_workers,
-                shuffle=False,
-            )
+            dataset = self.val_dataset
+
+        return DataLoader(
+            dataset,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            pin_memory=True,
+            shuffle=False,
+            **self._worker_kwargs(),
+        )
 
     def test_dataloader(self) -> DataLoader[Any]:
         """Return a DataLoader for testing.
@@ -388,5 +478,7 @@ class XView2DataModule(pl.LightningDataModule):
             self.test_dataset,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
+            pin_memory=True,
             shuffle=False,
+            **self._worker_kwargs(),
         )